@@ -6,6 +6,7 @@ Generic AWS publisher
 
 """
 import abc
+import pickle
 
 import pandas
 
@@ -26,8 +27,12 @@ class AWSGenericPublisher(Publisher.Publisher, metaclass=abc.ABCMeta):
         self.graphite_context_header = config.get("graphite_context", DEFAULT_GRAPHITE_CONTEXT)
         self.max_retries = config.get("max_retries", 2)
         self.retry_interval = config.get("retry_interval", 60)
+        self.graphite_queue_size = config.get("graphite_queue_size", 0)
+        self.graphite_pickle_protocol = config.get("graphite_pickle_protocol", pickle.HIGHEST_PROTOCOL)
         self.publish_to_graphite = config.get("publish_to_graphite")
         self.output_file = config.get("output_file")
+        # Created on first publish and kept to reuse its graphite connection
+        self.end_point = None
 
     @classmethod
     def consumes_dataframe(cls, product_name):
@@ -55,8 +60,15 @@ class AWSGenericPublisher(Publisher.Publisher, metaclass=abc.ABCMeta):
             return
         data = data_block[list(self._consumes.keys())[0]]
         if self.graphite_host and self.publish_to_graphite:
-            end_point = graphite.Graphite(host=self.graphite_host, pickle_port=self.graphite_port, logger=self.logger)
-            end_point.send_dict(
+            if self.end_point is None:
+                self.end_point = graphite.Graphite(
+                    host=self.graphite_host,
+                    pickle_port=self.graphite_port,
+                    logger=self.logger,
+                    pickle_protocol=self.graphite_pickle_protocol,
+                    queue_size=self.graphite_queue_size,
+                )
+            self.end_point.send_dict(
                 self.graphite_context(data)[0],
                 self.graphite_context(data)[1],
                 debug_print=False,
@@ -6,6 +6,7 @@ Generic publisher for graphana
 
 """
 import abc
+import pickle
 
 import pandas
 
@@ -24,6 +25,16 @@ DEFAULT_GRAPHITE_CONTEXT = ""
     Parameter("graphite_port", default=DEFAULT_GRAPHITE_PORT),
     Parameter("max_retries", default=2, comment="Number of retries allowed to send data to Graphite."),
     Parameter("retry_interval", default=60, comment="Number of seconds to wait between retries."),
+    Parameter(
+        "graphite_queue_size",
+        default=0,
+        comment="If > 0, send to Graphite in the background, queuing up to this many messages.",
+    ),
+    Parameter(
+        "graphite_pickle_protocol",
+        default=pickle.HIGHEST_PROTOCOL,
+        comment="Pickle protocol of the messages, 2 for a carbon running on Python 2.",
+    ),
     Parameter("graphite_context", default=DEFAULT_GRAPHITE_CONTEXT),
     Parameter("publish_to_graphite", type=bool),
     Parameter("output_file", type=str),
@@ -36,8 +47,12 @@ class GenericPublisher(Publisher.Publisher, metaclass=abc.ABCMeta):
         self.graphite_context_header = config.get("graphite_context", DEFAULT_GRAPHITE_CONTEXT)
         self.max_retries = config.get("max_retries", 2)
         self.retry_interval = config.get("retry_interval", 60)
+        self.graphite_queue_size = config.get("graphite_queue_size", 0)
+        self.graphite_pickle_protocol = config.get("graphite_pickle_protocol", pickle.HIGHEST_PROTOCOL)
         self.publish_to_graphite = config.get("publish_to_graphite")
         self.output_file = config.get("output_file")
+        # Created on first publish and kept to reuse its graphite connection
+        self.end_point = None
 
     @classmethod
     def consumes_dataframe(cls, product_name):
@@ -70,8 +85,15 @@ class GenericPublisher(Publisher.Publisher, metaclass=abc.ABCMeta):
             self.logger.exception(f"Failed to extract {product} from data block.")
             return
         if self.graphite_host and self.publish_to_graphite:
-            end_point = graphite.Graphite(host=self.graphite_host, pickle_port=self.graphite_port, logger=self.logger)
-            end_point.send_dict(
+            if self.end_point is None:
+                self.end_point = graphite.Graphite(
+                    host=self.graphite_host,
+                    pickle_port=self.graphite_port,
+                    logger=self.logger,
+                    pickle_protocol=self.graphite_pickle_protocol,
+                    queue_size=self.graphite_queue_size,
+                )
+            self.end_point.send_dict(
                 self.graphite_context(data)[0],
                 self.graphite_context(data)[1],
                 debug_print=False,
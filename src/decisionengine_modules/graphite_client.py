@@ -1,65 +1,199 @@
 # SPDX-FileCopyrightText: 2017 Fermi Research Alliance, LLC
 # SPDX-License-Identifier: Apache-2.0
 
+import collections
+import contextlib
 import pickle
+import select
 import socket
 import struct
+import threading
 import time
 
 from functools import partial
 
 from decisionengine_modules.util.retry_function import retry_wrapper
 
+# Seconds a connect or send may block before giving up on carbon
+SOCKET_TIMEOUT = 5.0
+# Longest wait between two reconnection attempts of the background sender
+MAX_SEND_BACKOFF = 60
 
-def sanitize_key(key):
-    if key is None:
-        return key
-    replacements = {
+
+_SANITIZE_TABLE = str.maketrans(
+    {
         ".": "_",
         " ": "_",
     }
-    for old, new in replacements.items():
-        key = key.replace(old, new)
-    return key
+)
+
+
+def sanitize_key(key):
+    if key is None:
+        return key
+    return key.translate(_SANITIZE_TABLE)
 
 
 class Graphite:
-    def __init__(self, host="fifemondata.fnal.gov", pickle_port=2004, logger=None):
+    def __init__(
+        self,
+        host="fifemondata.fnal.gov",
+        pickle_port=2004,
+        logger=None,
+        pickle_protocol=pickle.HIGHEST_PROTOCOL,
+        queue_size=0,
+    ):
+        """queue_size > 0 makes sends asynchronous: messages are queued, up to
+        queue_size of them dropping the oldest, and sent by a background thread"""
         self.graphite_host = host
         self.graphite_pickle_port = pickle_port
         self.logger = logger
+        # carbon unpickles with the protocols of the Python it runs on,
+        # lower it (e.g. to 2) for a carbon still running on Python 2
+        self.pickle_protocol = pickle_protocol
+        # Connection kept open across send_dict calls, see _send_to_graphite.
+        # _sock_lock serializes its use by the caller and the background sender
+        self._sock = None
+        self._sock_lock = threading.Lock()
+        self._queue = None
+        if queue_size > 0:
+            self._queue = collections.deque(maxlen=queue_size)
+            self._queue_ready = threading.Condition()
+            # started by the first queued send, stopped by close
+            self._sender = None
+            self._stop_sender = None
 
     def send_dict(self, namespace, data, debug_print=True, send_data=True, max_retries=2, retry_interval=60):
         """send data contained in dictionary as {k: v} to graphite dataset
         $namespace.k with current timestamp"""
-        if data is None:
-            if self.logger is not None:
-                self.logger.warning("Warning: send_dict called with no data")
-            return
+        self.send_many([(namespace, data)], debug_print, send_data, max_retries, retry_interval)
 
+    def send_many(self, items, debug_print=True, send_data=True, max_retries=2, retry_interval=60):
+        """send several (namespace, data) dictionaries, as in send_dict,
+        to graphite in a single pickle message"""
         now = int(time.time())
         post_data = []
-        # turning data dict into [('$path.$key',($timestamp,$value)),...]]
-        for k, v in data.items():
-            t = (namespace + "." + k, (now, v))
-            post_data.append(t)
-            if debug_print and self.logger is not None:
-                self.logger.debug(f"{t}")
+        for namespace, data in items:
+            if data is None:
+                if self.logger is not None:
+                    self.logger.warning(f"Warning: send_dict called with no data for {namespace}")
+                continue
+            post_data.extend(self._post_data(namespace, data, now, debug_print))
+        if not post_data:
+            return
         # pickle data
-        payload = pickle.dumps(post_data, protocol=2)
+        payload = pickle.dumps(post_data, protocol=self.pickle_protocol)
         header = struct.pack("!L", len(payload))
         message = header + payload
 
         if not send_data:
             return
         # throw data at graphite
+        if self._queue is not None:
+            # max_retries and retry_interval do not apply, _drain_queue retries until sent or dropped
+            self._enqueue(message)
+            return
 
         retry_wrapper(partial(self._send_to_graphite, message), max_retries, retry_interval, logger=self.logger)
 
+    def _post_data(self, namespace, data, now, debug_print=True):
+        # turning data dict into [('$path.$key',($timestamp,$value)),...]]
+        post_data = []
+        for k, v in data.items():
+            t = (namespace + "." + k, (now, v))
+            post_data.append(t)
+            if debug_print and self.logger is not None:
+                self.logger.debug(f"{t}")
+        return post_data
+
+    def _enqueue(self, message):
+        with self._queue_ready:
+            if len(self._queue) == self._queue.maxlen and self.logger is not None:
+                self.logger.warning(f"Graphite queue full, dropping the oldest of {len(self._queue)} messages")
+            self._queue.append(message)
+            if self._sender is None:
+                self._stop_sender = threading.Event()
+                self._sender = threading.Thread(
+                    target=self._drain_queue, args=(self._stop_sender,), name="graphite-sender", daemon=True
+                )
+                self._sender.start()
+            self._queue_ready.notify()
+
+    def _drain_queue(self, stop):
+        # background sender: send the oldest queued message, backing off
+        # exponentially while carbon cannot be reached, until stop is set
+        backoff = 1
+        while True:
+            with self._queue_ready:
+                self._queue_ready.wait_for(lambda: self._queue or stop.is_set())
+                if stop.is_set():
+                    return
+                message = self._queue[0]
+            try:
+                self._send_to_graphite(message)
+            except Exception as e:
+                if self.logger is not None:
+                    self.logger.warning(f"Failed sending to graphite with {e}. Sleeping {backoff:d} seconds")
+                with self._queue_ready:
+                    # woken up early by close
+                    self._queue_ready.wait_for(stop.is_set, backoff)
+                backoff = min(2 * backoff, MAX_SEND_BACKOFF)
+                continue
+            backoff = 1
+            with self._queue_ready:
+                # unless it was pushed out meanwhile by newer messages
+                if self._queue and self._queue[0] is message:
+                    self._queue.popleft()
+
+    def close(self):
+        """close the connection to graphite and stop the background sender,
+        the next send reconnects. Queued messages not sent yet are kept"""
+        if self._queue is not None:
+            with self._queue_ready:
+                sender, self._sender = self._sender, None
+                if sender is not None:
+                    self._stop_sender.set()
+                    self._queue_ready.notify_all()
+            if sender is not None:
+                # at most a connect and a send in progress
+                sender.join(2 * SOCKET_TIMEOUT)
+        with self._sock_lock:
+            self._close_socket()
+
+    def _close_socket(self):
+        # with _sock_lock held
+        if self._sock is not None:
+            with contextlib.suppress(OSError):
+                self._sock.close()
+            self._sock = None
+
     def _send_to_graphite(self, message):
-        with socket.socket() as s:
-            s.connect((self.graphite_host, self.graphite_pickle_port))
-            s.sendall(message)
+        with self._sock_lock:
+            if self._sock is not None and self._peer_closed():
+                # carbon drops idle connections, do not write into a dead one
+                self._close_socket()
+            try:
+                if self._sock is None:
+                    self._sock = socket.create_connection(
+                        (self.graphite_host, self.graphite_pickle_port), timeout=SOCKET_TIMEOUT
+                    )
+                    self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self._sock.sendall(message)
+            except OSError:
+                # reconnect on the next (retried) send
+                self._close_socket()
+                raise
+
+    def _peer_closed(self):
+        # carbon never writes on the pickle port: a readable socket means EOF or error.
+        # poll rather than select, which cannot watch fds >= FD_SETSIZE
+        try:
+            poller = select.poll()
+            poller.register(self._sock, select.POLLIN)
+            return bool(poller.poll(0)) and self._sock.recv(1, socket.MSG_PEEK) == b""
+        except Exception:
+            # whatever went wrong, the socket is not worth reusing
+            return True
 
 
 if __name__ == "__main__":
@@ -6,10 +6,40 @@
 import abc
 import contextlib
 import os
-import sys
 
+from collections import defaultdict
+
+import classad
 import htcondor
 
+# Resource string to classad type, used by resource_str_to_py_adtype
+_ADTYPES = {
+    "any": htcondor.AdTypes.Any,
+    "collector": htcondor.AdTypes.Collector,
+    "generic": htcondor.AdTypes.Generic,
+    "grid": htcondor.AdTypes.Grid,
+    "had": htcondor.AdTypes.HAD,
+    "license": htcondor.AdTypes.License,
+    "master": htcondor.AdTypes.Master,
+    "negotiator": htcondor.AdTypes.Negotiator,
+    "schedd": htcondor.AdTypes.Schedd,
+    "startd": htcondor.AdTypes.Startd,
+    "submitter": htcondor.AdTypes.Submitter,
+}
+
+_UNDEFINED = classad.Value.Undefined
+# Requirements and START cannot be evaluated until the jobs and slots match.
+# This causes issues so better to bypass them in eval_classad_expr.
+# TODO: If we come across other user configured attributes
+#       then we need to identify how to resolve this issue.
+_UNEVALUATED_ATTRS = frozenset(("Requirements", "START"))
+# Marks a grouping attribute not found in an element
+_MISSING = object()
+
+# condor_config last loaded by condor_collector, None for the default
+# configuration the bindings load at import
+_last_condor_config = None
+
 
 class QueryError(RuntimeError):
     """
@@ -48,6 +78,13 @@ class Query(metaclass=abc.ABCMeta):
         """
         self.stored_data = self.fetch(constraint, format_list, condor_config)
 
+    def load_many(self, queries, condor_config=None):
+        """
+        Fetch the data for each (constraint, format_list) in queries and
+        store the list of results in self.stored_data
+        """
+        self.stored_data = [self.fetch(constraint, format_list, condor_config) for constraint, format_list in queries]
+
     def fetch_stored(self, constraint_func=None):
         """
         :param constraint_func: A boolean function, with only one argument
@@ -65,6 +102,10 @@ class CondorQuery(Query):
     Fully implemented class for CondorQuery
     """
 
+    # Collectors shared by all the queries, keyed by (pool_name, condor_config),
+    # see condor_collector
+    _collector_cache = {}
+
     def __init__(self, resource_str, group_attr, pool_name=None, env=None):
         if env is None:
             env = {}
@@ -96,37 +137,73 @@ class CondorQ(CondorQuery):
         Fetch job classads
         """
 
-        results = []
-        constraint = bindings_friendly_constraint(constraint)
-        attrs = bindings_friendly_attrs(format_list)
+        batch = CondorQueryBatch(pool_name=self.pool_name)
+        return batch.fetch([(self.schedd_name, constraint, format_list)], condor_config)[0]
 
-        old_condor_config_env = os.environ.get("CONDOR_CONFIG")
+    def load_many(self, queries, condor_config=None):
+        """
+        Fetch the job classads for each (constraint, format_list) in queries
+        from this schedd in a single batch
+        """
+        batch = CondorQueryBatch(pool_name=self.pool_name)
+        self.stored_data = batch.fetch(
+            [(self.schedd_name, constraint, format_list) for constraint, format_list in queries], condor_config
+        )
+
+
+class CondorQueryBatch:
+    """
+    Class to run several condor_q queries against schedds of the same pool,
+    reloading the condor configuration and building the Collector only once
+    """
+
+    def __init__(self, pool_name=None):
+        self.pool_name = pool_name
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return f"{vars(self)}"
+
+    def fetch(self, queries, condor_config=None):
+        """
+        :param queries: (schedd_name, constraint, format_list) tuples.
+                        A schedd_name of None stands for the local schedd.
+        :type queries :obj: `list`
+
+        @rtype: list
+        @return: The list of evaluated job classads of each query,
+                 in the same order as queries
+
+        The first failing query raises QueryError and stops the batch.
+        """
+
+        results = []
+        # Named in the error should loading the configuration or the Collector fail
+        schedd_name = queries[0][0] if queries else None
         try:
-            if condor_config and os.path.exists(condor_config):
-                os.environ["CONDOR_CONFIG"] = condor_config
-            htcondor.reload_config()
-            if self.pool_name:
-                collector = htcondor.Collector(str(self.pool_name))
-            else:
-                collector = htcondor.Collector()
-            if self.schedd_name is None:
-                schedd = htcondor.Schedd()
-            else:
-                schedd = htcondor.Schedd(collector.locate(htcondor.DaemonTypes.Schedd, self.schedd_name))
-            classads = schedd.query(constraint, attrs)
-            results = eval_classad_expr(classads, format_list=format_list)
+            with condor_collector(self.pool_name, condor_config) as collector:
+                for schedd_name, constraint, format_list in queries:
+                    if schedd_name is None:
+                        schedd = htcondor.Schedd()
+                    else:
+                        schedd = htcondor.Schedd(collector.locate(htcondor.DaemonTypes.Schedd, schedd_name))
+                    constraint = bindings_friendly_constraint(constraint)
+                    attrs = bindings_friendly_attrs(format_list)
+                    # Not xquery: deprecated since 10.7, it also keeps a schedd fork
+                    # alive while the ads are streamed
+                    classads = schedd.query(constraint, attrs)
+                    results.append(eval_classad_expr(classads, format_list=format_list))
         except Exception as ex:
             s = "default"
-            if self.schedd_name is not None:
-                s = self.schedd_name
+            if schedd_name is not None:
+                s = schedd_name
             p = "default"
             if self.pool_name is not None:
                 p = self.pool_name
             err_str = f"Error querying schedd {s} in pool {p} using python bindings: {ex}"
-            raise QueryError(err_str).with_traceback(sys.exc_info()[2])
-        finally:
-            if old_condor_config_env:
-                os.environ["CONDOR_CONFIG"] = old_condor_config_env
+            raise QueryError(err_str) from ex
 
         return results
 
@@ -153,32 +230,92 @@ class CondorStatus(CondorQuery):
         """
         if self.logger is not None:
             self.logger.debug("in CondorStatus fetch")
+        return self._fetch_batch([(constraint, format_list)], condor_config)[0]
+
+    def load_many(self, queries, condor_config=None):
+        """
+        Fetch the resource classads for each (constraint, format_list) in
+        queries from this pool in a single batch
+        """
+        if self.logger is not None:
+            self.logger.debug("in CondorStatus load_many")
+        self.stored_data = self._fetch_batch(queries, condor_config)
+
+    def _fetch_batch(self, queries, condor_config=None):
+        """
+        Run all the (constraint, format_list) queries with the same Collector
+        and return the list of evaluated classads of each one
+        """
         results = []
-        constraint = bindings_friendly_constraint(constraint)
-        attrs = bindings_friendly_attrs(format_list)
         adtype = resource_str_to_py_adtype(self.resource_str)
-        old_condor_config_env = os.environ.get("CONDOR_CONFIG")
         try:
-            if condor_config and os.path.exists(condor_config):
-                os.environ["CONDOR_CONFIG"] = condor_config
-            htcondor.reload_config()
-            if self.pool_name:
-                collector = htcondor.Collector(str(self.pool_name))
-            else:
-                collector = htcondor.Collector()
-            classads = collector.query(adtype, constraint, attrs)
-            results = eval_classad_expr(classads, format_list=format_list)
+            with condor_collector(self.pool_name, condor_config) as collector:
+                for constraint, format_list in queries:
+                    classads = collector.query(
+                        adtype, bindings_friendly_constraint(constraint), bindings_friendly_attrs(format_list)
+                    )
+                    results.append(eval_classad_expr(classads, format_list=format_list, logger=self.logger))
         except Exception as ex:
             p = "default"
             if self.pool_name is not None:
                 p = self.pool_name
             err_str = f"Error querying pool {p} using python bindings: {ex}"
-            raise QueryError(err_str).with_traceback(sys.exc_info()[2])
+            raise QueryError(err_str) from ex
+
+        return results
+
+
+def load_condor_config(condor_config=None):
+    """
+    Make the bindings use condor_config if it exists (the default condor
+    configuration otherwise) and return the configuration loaded, None for
+    the default one. CONDOR_CONFIG is restored once loaded.
+    The configuration is only reloaded when it differs from the last one loaded,
+    everything calling htcondor.reload_config must go through here to keep that true.
+    """
+
+    global _last_condor_config
+    target_config = condor_config if condor_config and os.path.exists(condor_config) else None
+    if target_config != _last_condor_config:
+        old_condor_config_env = os.environ.get("CONDOR_CONFIG")
+        try:
+            if target_config:
+                os.environ["CONDOR_CONFIG"] = target_config
+            htcondor.reload_config()
+            _last_condor_config = target_config
         finally:
-            if old_condor_config_env:
+            if old_condor_config_env is not None:
                 os.environ["CONDOR_CONFIG"] = old_condor_config_env
+            else:
+                # Unset it again so a later reload picks up the default configuration
+                os.environ.pop("CONDOR_CONFIG", None)
+    return target_config
 
-        return results
+
+@contextlib.contextmanager
+def condor_collector(pool_name=None, condor_config=None):
+    """
+    Load condor_config, see load_condor_config, and yield the Collector of
+    pool_name (default collector if pool_name is None).
+    The Collector is reused across calls until a query using it fails.
+    """
+
+    target_config = load_condor_config(condor_config)
+    # The default collector depends on the configuration, so is the key
+    cache_key = (pool_name, target_config)
+    collector = CondorQuery._collector_cache.get(cache_key)
+    if collector is None:
+        if pool_name:
+            collector = htcondor.Collector(str(pool_name))
+        else:
+            collector = htcondor.Collector()
+        CondorQuery._collector_cache[cache_key] = collector
+    try:
+        yield collector
+    except Exception:
+        # Do not hand a possibly broken Collector to the next query
+        CondorQuery._collector_cache.pop(cache_key, None)
+        raise
 
 
 def apply_constraint(data, constraint_func):
@@ -189,12 +326,7 @@ def apply_constraint(data, constraint_func):
 
     if constraint_func is None:
         return data
-    else:
-        outdata = {}
-        for key, val in data.items():
-            if constraint_func(val):
-                outdata[key] = val
-    return outdata
+    return {key: val for key, val in data.items() if constraint_func(val)}
 
 
 def resource_str_to_py_adtype(resource_str):
@@ -202,21 +334,8 @@ def resource_str_to_py_adtype(resource_str):
     Given the resource string return equivalent classad type
     """
 
-    adtypes = {
-        "any": htcondor.AdTypes.Any,
-        "collector": htcondor.AdTypes.Collector,
-        "generic": htcondor.AdTypes.Generic,
-        "grid": htcondor.AdTypes.Grid,
-        "had": htcondor.AdTypes.HAD,
-        "license": htcondor.AdTypes.License,
-        "master": htcondor.AdTypes.Master,
-        "negotiator": htcondor.AdTypes.Negotiator,
-        "schedd": htcondor.AdTypes.Schedd,
-        "startd": htcondor.AdTypes.Startd,
-        "submitter": htcondor.AdTypes.Submitter,
-    }
     # Default to startd ads, even if resource_str is empty
-    return adtypes.get(resource_str, htcondor.AdTypes.Startd)
+    return _ADTYPES.get(resource_str, htcondor.AdTypes.Startd)
 
 
 def bindings_friendly_constraint(constraint):
@@ -242,88 +361,117 @@ def bindings_friendly_attrs(format_list):
     return attrs
 
 
-def list2dict(list_data, attr_name):
+def list2dict(list_data, attr_name, logger=None):
     """
     Convert a list to a dictionary and group the results based on
     attributes specified by attr_name
     """
 
+    # Pick the variant once rather than checking attr_name for every element
     if isinstance(attr_name, (list, tuple)):
-        attr_list = attr_name
-    else:
-        attr_list = [attr_name]
+        return _list2dict_multi(list_data, attr_name, logger)
+    return _list2dict_single(list_data, attr_name, logger)
+
 
-    dict_data = {}
+def _list2dict_single(list_data, attr_name, logger=None):
+    """
+    list2dict grouping on the value of the single attribute attr_name
+    """
+
+    group_attrs = (attr_name,)
+    dict_data = defaultdict(list)
     for list_el in list_data:
-        if isinstance(attr_name, (list, tuple)):
-            dict_name = []
-            for an in attr_name:
-                if an in list_el:
-                    dict_name.append(list_el[an])
-                else:
-                    # Try lower cases
-                    for k in list_el:
-                        if an.lower() == k.lower():
-                            dict_name.append(list_el[k])
-                            break
-            dict_name = tuple(dict_name)
-        else:
+        dict_el = {}
+        dict_name = _eval_attrs(list_el, dict_el, group_attrs, logger).get(attr_name, _MISSING)
+        if dict_name is _MISSING:
+            # Not an exact match, ClassAd lookups ignore the case
             dict_name = list_el[attr_name]
+        dict_data[dict_name].append(dict_el)
+    return dict(dict_data)
+
+
+def _list2dict_multi(list_data, attr_names, logger=None):
+    """
+    list2dict grouping on the tuple of the values of the attributes in attr_names
+    """
+
+    wanted_groups = set(attr_names)
+    dict_data = defaultdict(list)
+    for list_el in list_data:
         dict_el = {}
-        for a in list_el:
-            if a not in attr_list:
-                with contextlib.suppress(Exception):
-                    if list_el[a].__class__.__name__ == "ExprTree":
-                        # Try to evaluate the condor expr and use its value
-                        # If cannot be evaluated, keep the expr as is
-                        a_value = list_el[a].eval()
-                        if f"{a_value}" != "Undefined":
-                            # Cannot use classad.Value.Undefined for
-                            # for comparison as it gets cast to int
-                            dict_el[a] = a_value
-                    elif str(list_el[a]) != "Undefined":
-                        # No need for Undefined check to see if
-                        # attribute exists in the fetched classad
-                        dict_el[a] = list_el[a]
-
-        if dict_name not in dict_data:
-            dict_data[dict_name] = []
+        group_vals = _eval_attrs(list_el, dict_el, wanted_groups, logger)
+        if len(group_vals) == len(wanted_groups):
+            dict_name = tuple(group_vals[an] for an in attr_names)
+        else:
+            # Try lower cases, mapping them only once per element
+            lower_keys = {k.lower(): k for k in list_el}
+            dict_name = []
+            for an in attr_names:
+                val = group_vals.get(an, _MISSING)
+                if val is _MISSING:
+                    k = lower_keys.get(an.lower())
+                    if k is not None:
+                        val = list_el[k]
+                if val is not _MISSING:
+                    dict_name.append(val)
+            dict_name = tuple(dict_name)
         dict_data[dict_name].append(dict_el)
-    return dict_data
+    return dict(dict_data)
+
 
+def _eval_attrs(ad, dict_el, skip, logger=None):
+    """
+    Add the attributes of ad, but those in skip, to dict_el, evaluating the
+    expressions and dropping the undefined values and the "Undefined" strings.
+    printJson() does not evaluate expressions, so only the ExprTree values are
+    evaluated. Attributes that fail are logged and left out.
+    Return the attributes of ad in skip, with their values as is
+    """
 
-def eval_classad_expr(classads, format_list=None):
+    skipped = {}
+    # Iterate over a copy: resuming after an exception then never hits an
+    # iterator that failed, and attr always names the failing attribute
+    attrs = iter(list(ad.items()))
+    while True:
+        # One handler for the whole ad: when an attribute fails,
+        # it is skipped and the loop resumes with the next attribute
+        try:
+            for attr, a_value in attrs:
+                if attr in skip:
+                    skipped[attr] = a_value
+                    continue
+                if isinstance(a_value, classad.ExprTree):
+                    # Try to evaluate the condor expr and use its value
+                    a_value = a_value.eval()
+                # Undefined is a singleton, compare it by identity. Only compare
+                # strings to "Undefined": for an Error value != builds an ExprTree
+                if a_value is not _UNDEFINED and not (a_value.__class__ is str and a_value == "Undefined"):
+                    dict_el[attr] = a_value
+            return skipped
+        except Exception as e:
+            if logger is not None:
+                logger.debug(f"Skipping classad attribute {attr}: {e}")
+
+
+def eval_classad_expr(classads, format_list=None, logger=None):
     """
     Convert the classads into list of classads
     Guarantees any attribute in format_list to be added with default value None
     """
 
+    # The required attributes from format_list, copied for every classad
+    if format_list and isinstance(format_list, list):
+        defaults = dict.fromkeys(format_list)
+    else:
+        defaults = {}
     classad_list = []
-    for classad in classads:
-        # Initialize the required attributes from format_list
-        if format_list and isinstance(format_list, list):
-            dict_el = {key: None for key in format_list}
-        else:
-            dict_el = {}
-        for attr in classad:
-            if attr in ("Requirements", "START"):
-                # Requirements and START cannot be evaluated until the
-                # jobs and slots match. This causes issues so better to
-                # bypass.
-                # TODO: If we come across other user configured attributes
-                #       then we need to identify how to resolve this issue.
-                continue
-            with contextlib.suppress(Exception):
-                if classad[attr].__class__.__name__ == "ExprTree":
-                    a_value = classad[attr].eval()
-                    if f"{a_value}" != "Undefined":
-                        # Cannot use classad.Value.Undefined
-                        # for comparison as it gets cast to int
-                        dict_el[attr] = a_value
-                elif str(classad[attr]) != "Undefined":
-                    # No need for Undefined check to see if
-                    # attribute exists in the fetched classad
-                    dict_el[attr] = classad[attr]
+    # All the attributes of the ads are walked even when format_list was
+    # used as projection: the daemons add their own attributes that callers
+    # rely on (e.g. ServerTime for jobs, AuthenticatedIdentity for factories)
+    # and projected values still are unevaluated expressions.
+    for ad in classads:
+        dict_el = defaults.copy()
+        _eval_attrs(ad, dict_el, _UNEVALUATED_ATTRS, logger)
 
         # Do not delete this block until we resolve the TODO above.
         # Useful for identifying the attribute that causes the problem.
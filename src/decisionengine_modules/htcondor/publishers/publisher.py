@@ -12,6 +12,7 @@ import pandas
 
 from decisionengine.framework.modules import Publisher
 from decisionengine.framework.modules.Publisher import Parameter
+from decisionengine_modules.htcondor import htcondor_query
 from decisionengine_modules.util.retry_function import retry_wrapper
 
 DEFAULT_UPDATE_AD_COMMAND = "UPDATE_AD_GENERIC"
@@ -77,11 +78,8 @@ class HTCondorManifests(Publisher.Publisher, metaclass=abc.ABCMeta):
 
         ads = classads
 
-        old_condor_config_env = os.environ.get("CONDOR_CONFIG")
         try:
-            if self.condor_config and os.path.exists(self.condor_config):
-                os.environ["CONDOR_CONFIG"] = self.condor_config
-            htcondor.reload_config()
+            htcondor_query.load_condor_config(self.condor_config)
             if self.x509_user_proxy and os.path.exists(self.x509_user_proxy):
                 os.environ["X509_USER_PROXY"] = self.x509_user_proxy
 
@@ -105,9 +103,6 @@ class HTCondorManifests(Publisher.Publisher, metaclass=abc.ABCMeta):
             # err_str = 'Error advertising with command %s to pool %s: %s' % (self.update_ad_command, col, ex)
             # raise QueryError(err_str), None, sys.exc_info()[2]
             raise
-        finally:
-            if old_condor_config_env:
-                os.environ["CONDOR_CONFIG"] = old_condor_config_env
 
     def condor_advertise(self, classads, collector_host=None, update_ad_command=DEFAULT_UPDATE_AD_COMMAND):
         return retry_wrapper(
@@ -0,0 +1,157 @@
+# SPDX-FileCopyrightText: 2017 Fermi Research Alliance, LLC
+# SPDX-License-Identifier: Apache-2.0
+
+import pickle
+import socket
+import struct
+
+import pytest
+
+from decisionengine_modules import graphite_client
+
+
+@pytest.fixture
+def carbon():
+    """Local listening socket standing in for the carbon pickle receiver"""
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        server.settimeout(5)
+        yield server
+
+
+def read_message(conn):
+    (length,) = struct.unpack("!L", conn.recv(4, socket.MSG_WAITALL))
+    return pickle.loads(conn.recv(length, socket.MSG_WAITALL))
+
+
+def test_sanitize_key():
+    assert graphite_client.sanitize_key(None) is None
+    assert graphite_client.sanitize_key("a.b c") == "a_b_c"
+
+
+def test_send_dict_reuses_connection(carbon):
+    g = graphite_client.Graphite(host="127.0.0.1", pickle_port=carbon.getsockname()[1])
+    try:
+        g.send_dict("test", {"count1": 5}, max_retries=0)
+        conn, _ = carbon.accept()
+        with conn:
+            conn.settimeout(5)
+            [(path, (_, value))] = read_message(conn)
+            assert (path, value) == ("test.count1", 5)
+
+            g.send_dict("test", {"count2": 0.5}, max_retries=0)
+            [(path, (_, value))] = read_message(conn)
+            assert (path, value) == ("test.count2", 0.5)
+    finally:
+        g.close()
+
+
+def test_send_dict_reconnects_after_close(carbon):
+    g = graphite_client.Graphite(host="127.0.0.1", pickle_port=carbon.getsockname()[1])
+    try:
+        g.send_dict("test", {"count1": 5}, max_retries=0)
+        conn, _ = carbon.accept()
+        with conn:
+            conn.settimeout(5)
+            read_message(conn)
+        # the receiver went away, the next send must open a new connection
+        g.send_dict("test", {"count1": 6}, max_retries=0)
+        conn, _ = carbon.accept()
+        with conn:
+            conn.settimeout(5)
+            [(path, (_, value))] = read_message(conn)
+            assert (path, value) == ("test.count1", 6)
+    finally:
+        g.close()
+
+
+def test_send_many_single_message(carbon):
+    g = graphite_client.Graphite(host="127.0.0.1", pickle_port=carbon.getsockname()[1])
+    try:
+        g.send_many([("ns1", {"a": 1}), ("ns2", None), ("ns2", {"b": 2, "c": 3})], max_retries=0)
+        conn, _ = carbon.accept()
+        with conn:
+            conn.settimeout(5)
+            post_data = read_message(conn)
+        assert [(path, value) for path, (_, value) in post_data] == [("ns1.a", 1), ("ns2.b", 2), ("ns2.c", 3)]
+        assert len({ts for _, (ts, _) in post_data}) == 1
+    finally:
+        g.close()
+
+
+def test_send_dict_pickle_protocol(carbon):
+    g = graphite_client.Graphite(host="127.0.0.1", pickle_port=carbon.getsockname()[1], pickle_protocol=2)
+    try:
+        g.send_dict("test", {"count1": 5}, max_retries=0)
+        conn, _ = carbon.accept()
+        with conn:
+            conn.settimeout(5)
+            (length,) = struct.unpack("!L", conn.recv(4, socket.MSG_WAITALL))
+            payload = conn.recv(length, socket.MSG_WAITALL)
+        # protocol 2+ pickles start with the PROTO opcode and the protocol number
+        assert payload[:2] == b"\x80\x02"
+    finally:
+        g.close()
+
+
+def test_send_dict_queued(carbon):
+    g = graphite_client.Graphite(host="127.0.0.1", pickle_port=carbon.getsockname()[1], queue_size=10)
+    try:
+        for i in range(3):
+            g.send_dict("test", {"count": i})
+        conn, _ = carbon.accept()
+        with conn:
+            conn.settimeout(5)
+            assert [read_message(conn)[0][1][1] for _ in range(3)] == [0, 1, 2]
+    finally:
+        g.close()
+
+
+def test_send_dict_queue_drops_oldest():
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        port = server.getsockname()[1]
+    # nothing listens on the port anymore, messages pile up in the queue
+    g = graphite_client.Graphite(host="127.0.0.1", pickle_port=port, queue_size=2)
+    try:
+        for i in range(5):
+            g.send_dict("test", {"count": i})
+        with g._queue_ready:
+            assert [pickle.loads(message[4:])[0][1][1] for message in g._queue] == [3, 4]
+    finally:
+        g.close()
+
+
+def test_close_stops_sender(carbon):
+    g = graphite_client.Graphite(host="127.0.0.1", pickle_port=carbon.getsockname()[1], queue_size=10)
+    g.send_dict("test", {"count": 0})
+    sender = g._sender
+    g.close()
+    assert not sender.is_alive()
+    # the next send starts a new one
+    g.send_dict("test", {"count": 1})
+    try:
+        assert g._sender is not sender and g._sender.is_alive()
+    finally:
+        g.close()
+
+
+def test_send_dict_peer_check_failure_reconnects(carbon, monkeypatch):
+    g = graphite_client.Graphite(host="127.0.0.1", pickle_port=carbon.getsockname()[1])
+    try:
+        g.send_dict("test", {"count1": 5}, max_retries=0)
+        conn, _ = carbon.accept()
+        conn.close()
+        old_sock = g._sock
+
+        def broken_poll():
+            raise ValueError("broken check")
+
+        monkeypatch.setattr(graphite_client.select, "poll", broken_poll)
+        g.send_dict("test", {"count1": 6}, max_retries=0)
+        assert old_sock.fileno() == -1
+        conn, _ = carbon.accept()
+        with conn:
+            conn.settimeout(5)
+            [(path, (_, value))] = read_message(conn)
+            assert (path, value) == ("test.count1", 6)
+    finally:
+        g.close()
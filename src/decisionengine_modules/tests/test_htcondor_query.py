@@ -5,6 +5,7 @@ import os
 
 from unittest import mock
 
+import classad
 import pytest
 
 from decisionengine_modules.htcondor import htcondor_query
@@ -64,3 +65,204 @@ def test_condorstatus():
         f.return_value = utils.input_from_file(FIXTURE_FILE)
         condor_status.load()
         assert f.return_value == condor_status.stored_data
+
+
+@pytest.fixture
+def condor_config_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(htcondor_query, "_last_condor_config", None)
+    monkeypatch.setattr(htcondor_query.CondorQuery, "_collector_cache", {})
+    path = tmp_path / "condor_config"
+    path.write_text("")
+    return str(path)
+
+
+def test_condor_collector_reloads_only_on_change(condor_config_file):
+    with mock.patch.object(htcondor_query, "htcondor") as htc:
+        for _ in range(3):
+            with htcondor_query.condor_collector(condor_config=condor_config_file):
+                pass
+        assert htc.reload_config.call_count == 1
+        with htcondor_query.condor_collector():
+            pass
+        assert htc.reload_config.call_count == 2
+    assert htcondor_query._last_condor_config is None
+
+
+def test_load_condor_config_shared_with_condor_collector(condor_config_file, tmp_path, monkeypatch):
+    # e.g. HTCondorManifests loading its own configuration between two queries
+    other_config_file = tmp_path / "other_condor_config"
+    other_config_file.write_text("")
+    monkeypatch.delenv("CONDOR_CONFIG", raising=False)
+    with mock.patch.object(htcondor_query, "htcondor") as htc:
+        with htcondor_query.condor_collector(condor_config=condor_config_file):
+            pass
+        assert htcondor_query.load_condor_config(str(other_config_file)) == str(other_config_file)
+        assert htc.reload_config.call_count == 2
+        assert "CONDOR_CONFIG" not in os.environ
+        with htcondor_query.condor_collector(condor_config=condor_config_file):
+            pass
+        assert htc.reload_config.call_count == 3
+        assert htcondor_query.load_condor_config(condor_config_file) == condor_config_file
+        assert htc.reload_config.call_count == 3
+
+
+def test_condor_collector_cache(condor_config_file):
+    with mock.patch.object(htcondor_query, "htcondor") as htc:
+        htc.Collector.side_effect = lambda *args: mock.Mock()
+        with htcondor_query.condor_collector("pool.fnal.gov", condor_config_file) as collector:
+            pass
+        with htcondor_query.condor_collector("pool.fnal.gov", condor_config_file) as same_collector:
+            assert same_collector is collector
+        with htcondor_query.condor_collector("other.fnal.gov", condor_config_file) as other_collector:
+            assert other_collector is not collector
+        with pytest.raises(RuntimeError):
+            with htcondor_query.condor_collector("pool.fnal.gov", condor_config_file):
+                raise RuntimeError("query failed")
+        with htcondor_query.condor_collector("pool.fnal.gov", condor_config_file) as new_collector:
+            assert new_collector is not collector
+        assert htc.Collector.call_count == 3
+
+
+def test_condorquerybatch_reuses_collector(condor_config_file):
+    batch = htcondor_query.CondorQueryBatch(pool_name=config_cq.get("pool_name"))
+    with mock.patch.object(htcondor_query, "htcondor") as htc:
+        htc.Schedd.return_value = mock.Mock(spec=["query"])
+        htc.Schedd.return_value.query.return_value = [{"ClusterId": 1, "ProcId": 0}]
+        results = batch.fetch(
+            [("schedd1.fnal.gov", "procid < 2", ["ClusterId"]), ("schedd2.fnal.gov", None, ["ClusterId", "ProcId"])],
+            condor_config_file,
+        )
+        assert htc.reload_config.call_count == 1
+        assert htc.Collector.call_count == 1
+        assert htc.Collector.return_value.locate.call_count == 2
+        htc.Schedd.return_value.query.assert_called_with(True, ["ClusterId", "ProcId"])
+    assert results == [[{"ClusterId": 1, "ProcId": 0}], [{"ClusterId": 1, "ProcId": 0}]]
+
+
+def test_condorq_queryerror_names_schedd(condor_config_file):
+    condor_q = htcondor_query.CondorQ(schedd_name="s1.fnal.gov", pool_name="pool.fnal.gov")
+    with mock.patch.object(htcondor_query, "htcondor") as htc:
+        htc.Collector.side_effect = RuntimeError("no collector")
+        with pytest.raises(htcondor_query.QueryError, match="schedd s1.fnal.gov in pool pool.fnal.gov"):
+            condor_q.fetch(condor_config=condor_config_file)
+
+
+def test_condorstatus_load_many(condor_config_file):
+    condor_status = htcondor_query.CondorStatus(subsystem_name="any", pool_name=config_cs.get("pool_name"))
+    with mock.patch.object(htcondor_query, "htcondor") as htc:
+        htc.Collector.return_value.query.return_value = [{"Name": "slot1", "Activity": "Idle"}]
+        condor_status.load_many([(None, ["Name"]), ('State == "Claimed"', ["Name", "Activity"])], condor_config_file)
+        assert htc.reload_config.call_count == 1
+        assert htc.Collector.return_value.query.call_count == 2
+    assert condor_status.stored_data == [
+        [{"Name": "slot1", "Activity": "Idle"}],
+        [{"Name": "slot1", "Activity": "Idle"}],
+    ]
+
+
+def _job_ads():
+    return [
+        classad.ClassAd(
+            {
+                "ClusterId": 1,
+                "ProcId": 0,
+                "RequestCpus": 1,
+                "RequestMemory": classad.ExprTree("RequestCpus * 2048"),
+                "Unset": classad.ExprTree("MY.DoesNotExist"),
+            }
+        ),
+        classad.ClassAd({"ClusterId": 1, "ProcId": 1, "RequestCpus": 4}),
+    ]
+
+
+def test_eval_classad_expr():
+    results = htcondor_query.eval_classad_expr(_job_ads(), format_list=["ClusterId", "RequestMemory"])
+    assert results == [
+        {"ClusterId": 1, "ProcId": 0, "RequestCpus": 1, "RequestMemory": 2048},
+        {"ClusterId": 1, "ProcId": 1, "RequestCpus": 4, "RequestMemory": None},
+    ]
+    # The "Undefined" string is dropped like the undefined value, errors are kept
+    ads = [classad.ClassAd('[F = "Undefined"; U = UNDEFINED; E = error; G = 1 + "a"; S = "x"]')]
+    results = htcondor_query.eval_classad_expr(ads, format_list=["F", "U"])
+    assert results == [{"F": None, "U": None, "E": classad.Value.Error, "G": classad.Value.Error, "S": "x"}]
+
+
+def test_list2dict():
+    assert htcondor_query.list2dict(_job_ads(), ["ClusterId", "ProcId"]) == {
+        (1, 0): [{"RequestCpus": 1, "RequestMemory": 2048}],
+        (1, 1): [{"RequestCpus": 4}],
+    }
+    assert htcondor_query.list2dict(_job_ads(), "ClusterId") == {
+        1: [{"ProcId": 0, "RequestCpus": 1, "RequestMemory": 2048}, {"ProcId": 1, "RequestCpus": 4}],
+    }
+
+
+def test_list2dict_drops_undefined():
+    ads = [
+        classad.ClassAd(
+            {
+                "ClusterId": 1,
+                "ProcId": 0,
+                "Owner": "Undefined",
+                "RequestDisk": classad.ExprTree("UNDEFINED"),
+                "RequestCpus": classad.ExprTree("1 + 1"),
+                "E": classad.ExprTree("error"),
+                "G": classad.ExprTree('1 + "a"'),
+            }
+        )
+    ]
+    error = classad.Value.Error
+    assert htcondor_query.list2dict(ads, "ClusterId") == {1: [{"ProcId": 0, "RequestCpus": 2, "E": error, "G": error}]}
+    assert htcondor_query.list2dict(ads, ["ClusterId", "ProcId"]) == {
+        (1, 0): [{"RequestCpus": 2, "E": error, "G": error}]
+    }
+
+
+def test_eval_classad_expr_logs_failing_attrs():
+    class FailingExpr(classad.ExprTree):
+        def eval(self, *args):
+            raise RuntimeError("cannot evaluate")
+
+    logger = mock.Mock()
+    ads = [{"A": 1, "B": FailingExpr("1"), "C": 3}]
+    assert htcondor_query.eval_classad_expr(ads, logger=logger) == [{"A": 1, "C": 3}]
+    assert htcondor_query.list2dict(ads, "A", logger=logger) == {1: [{"C": 3}]}
+    assert logger.debug.call_count == 2
+    assert "B" in logger.debug.call_args[0][0]
+
+
+def test_list2dict_case_insensitive_group_attrs():
+    data = [{"clusterid": 1, "PROCID": 0, "JobStatus": 1}, {"ClusterId": 2, "ProcId": 0, "JobStatus": 2}]
+    assert htcondor_query.list2dict(data, ["ClusterId", "ProcId"]) == {
+        (1, 0): [{"clusterid": 1, "PROCID": 0, "JobStatus": 1}],
+        (2, 0): [{"JobStatus": 2}],
+    }
+
+
+def test_apply_constraint():
+    data = {"a": {"JobStatus": 1}, "b": {"JobStatus": 2}}
+    assert htcondor_query.apply_constraint(data, None) is data
+    assert htcondor_query.apply_constraint(data, lambda el: el["JobStatus"] == 2) == {"b": {"JobStatus": 2}}
+
+
+def test_list2dict_classad_lookup_is_case_insensitive():
+    grouped = htcondor_query.list2dict(_job_ads(), "clusterid")
+    assert list(grouped) == [1]
+    grouped = htcondor_query.list2dict(_job_ads(), ["clusterid", "procid"])
+    assert list(grouped) == [(1, 0), (1, 1)]
+
+
+def test_eval_classad_expr_keeps_attrs_added_by_daemons():
+    # Attributes beyond the projection, like ServerTime added by the schedd, are kept
+    ads = [classad.ClassAd({"JobStatus": 1, "ServerTime": 1700000000, "Requirements": classad.ExprTree("true")})]
+    assert htcondor_query.eval_classad_expr(ads, format_list=["JobStatus", "EnteredCurrentStatus"]) == [
+        {"JobStatus": 1, "EnteredCurrentStatus": None, "ServerTime": 1700000000}
+    ]
+
+
+def test_list2dict_missing_group_attr():
+    data = [{"ClusterId": 1, "JobStatus": 1}, {"ClusterId": 2, "ProcId": None, "JobStatus": 2}]
+    assert htcondor_query.list2dict(data, ["ClusterId", "ProcId"]) == {
+        (1,): [{"JobStatus": 1}],
+        (2, None): [{"JobStatus": 2}],
+    }